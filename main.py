@@ -1,11 +1,21 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 import os
-from notion_client import Client
-from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+import asyncio
+import hashlib
+import json
+from notion_client import AsyncClient
+from notion_http import NOTION_MAX_RATE, build_http_client
+from pydantic import BaseModel, Field
+from typing import Optional, List, Dict, Any, AsyncIterator, Awaitable, Callable
 import logging
+import orjson
+from cachetools import TTLCache
+from slowapi import Limiter, _rate_limit_exceeded_handler
+from slowapi.errors import RateLimitExceeded
+from slowapi.util import get_remote_address
 
 # Load environment variables
 load_dotenv()
@@ -14,30 +24,94 @@ load_dotenv()
 app = FastAPI(
     title="Notion Integration API",
     description="API for interacting with Notion databases and pages",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware to allow Custom GPT to make requests
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=[
-        "https://chat.openai.com",  # Allow CustomGPT to access
-        "http://localhost:8000",    # Local development
-        "http://localhost:3000",    # Local frontend if any
-    ],
+    # CustomGPT, local development (8000) and a local frontend if any (3000)
+    allow_origin_regex=r"^(https://chat\.openai\.com|http://localhost:(3000|8000))$",
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["Content-Type", "Authorization"],
 )
 
+def _client_address(request: Request) -> str:
+    """
+    Address of the caller as seen by the Heroku router, which appends it as the
+    last X-Forwarded-For hop. Earlier hops are whatever the client sent, so they
+    can't be trusted for rate limiting.
+    """
+    forwarded_for = request.headers.get("x-forwarded-for")
+    if forwarded_for:
+        return forwarded_for.rsplit(",", 1)[-1].strip()
+    return get_remote_address(request)
+
+# Limit how often each client can call the /notion endpoints. Counters are kept
+# in memory per worker, so the effective limit per client is RATE_LIMIT x WEB_CONCURRENCY.
+RATE_LIMIT = os.getenv("RATE_LIMIT", "30/minute")
+limiter = Limiter(key_func=_client_address)
+app.state.limiter = limiter
+app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+
 # Add better error handling
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize Notion client
-notion = Client(auth=os.getenv("NOTION_TOKEN"))
 database_id = os.getenv("NOTION_DATABASE_ID")
 
+# In-flight Notion requests, so concurrent identical calls share one round-trip
+tasks_cache: Dict[str, asyncio.Task] = {}
+
+# Recent read-only Notion responses, reused for NOTION_CACHE_TTL seconds
+response_cache: TTLCache = TTLCache(maxsize=512, ttl=int(os.getenv("NOTION_CACHE_TTL", 60)))
+response_cache_lock = asyncio.Lock()  # Guards response_cache and schema_cache
+
+# Database schemas rarely change, so they are kept for 5 minutes
+schema_cache: TTLCache = TTLCache(maxsize=32, ttl=300)
+
+class NotionCache:
+    """
+    Cache for rarely-changing Notion objects, shared for the lifetime of the process
+    """
+    def __init__(self, notion: AsyncClient):
+        self.notion = notion
+
+    async def get_schema(self, database_id: str) -> Dict[str, Any]:
+        """
+        Get a database's schema, fetching it from Notion at most once every 5 minutes
+        """
+        return await cached_or_compute(
+            f"schema:{database_id}",
+            lambda: self.notion.databases.retrieve(database_id=database_id),
+            cache=schema_cache
+        )
+
+@app.on_event("startup")
+async def startup():
+    """
+    Create a single Notion client whose HTTP connection pool is shared by every request
+    """
+    # Each worker process has its own rate limiter, so split Notion's budget between them
+    workers = int(os.getenv("WEB_CONCURRENCY", 1))
+    app.state.http_client = build_http_client(max_rate=NOTION_MAX_RATE / workers)
+    # The SDK overrides the client's timeout with its own, so keep them in sync
+    app.state.notion = AsyncClient(
+        auth=os.getenv("NOTION_TOKEN"),
+        client=app.state.http_client,
+        timeout_ms=30_000,
+    )
+    app.state.notion_cache = NotionCache(app.state.notion)
+
+@app.on_event("shutdown")
+async def shutdown():
+    """
+    Close the shared Notion connection pool
+    """
+    await app.state.http_client.aclose()
+
 class NotionPage(BaseModel):
     page_id: str
     content: Optional[str] = None
@@ -46,44 +120,120 @@ class NotionQuery(BaseModel):
     filter: Optional[Dict[str, Any]] = None
     sorts: Optional[List[Dict[str, Any]]] = None
 
+class PageIds(BaseModel):
+    # Each id costs at least one rate-limited Notion call, so cap the batch size
+    page_ids: List[str] = Field(..., min_length=1, max_length=25)
+
 class PaginationParams(BaseModel):
     start_cursor: Optional[str] = None
     page_size: Optional[int] = 10  # Default to 10 items per page
 
+async def _coalesce(key: str, coro_factory: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Await the in-flight task for key if there is one, otherwise start it
+    """
+    task = tasks_cache.get(key)
+    if task is None or task.done():
+        task = asyncio.create_task(coro_factory())
+        tasks_cache[key] = task
+
+        def _forget(finished: asyncio.Task) -> None:
+            if tasks_cache.get(key) is finished:
+                del tasks_cache[key]
+
+        task.add_done_callback(_forget)
+    # Shield the shared task so one caller disconnecting doesn't cancel it for the others
+    return await asyncio.shield(task)
+
+async def cached_or_compute(
+    key: str,
+    coro_factory: Callable[[], Awaitable[Any]],
+    cache: TTLCache = response_cache
+) -> Any:
+    """
+    Return the cached response for key, or fetch it (coalesced) and cache it
+    """
+    async with response_cache_lock:
+        if key in cache:
+            return cache[key]
+
+    result = await _coalesce(key, coro_factory)
+
+    async with response_cache_lock:
+        cache[key] = result
+    return result
+
+def _hash_key(*parts: Any) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+def _join_plain(rich_text: List[Dict[str, Any]]) -> str:
+    return "".join([text["plain_text"] for text in rich_text]) if rich_text else ""
+
+# Property types that are flattened to plain text, everything else is returned as-is
+FORMATTERS: Dict[str, Callable[[Any], Any]] = {
+    "title": _join_plain,
+    "rich_text": _join_plain,
+}
+
+# Block types whose text is included in page content
+TEXT_BLOCK_TYPES = frozenset({"paragraph", "heading_1", "heading_2", "heading_3", "bulleted_list_item"})
+
+# API information served by the root endpoint, serialised once at import time
+_ROOT_BYTES = orjson.dumps({
+    "message": "Notion Integration API",
+    "endpoints": {
+        "GET /notion/databases": "List all accessible databases",
+        "GET /notion/pages": "Query pages in the configured database",
+        "GET /notion/page/{page_id}": "Get specific page content",
+        "POST /notion/pages/full": "Get content of several pages at once",
+        "POST /notion/query": "Query database with filters",
+        "GET /notion/schema": "Get the configured database's schema"
+    }
+})
+
 @app.get("/")
 async def root():
     """
     Root endpoint returning API information
     """
-    return {
-        "message": "Notion Integration API",
-        "endpoints": {
-            "GET /notion/databases": "List all accessible databases",
-            "GET /notion/pages": "Query pages in the configured database",
-            "GET /notion/page/{page_id}": "Get specific page content",
-            "POST /notion/query": "Query database with filters"
-        }
-    }
+    return Response(content=_ROOT_BYTES, media_type="application/json")
 
 @app.get("/notion/databases")
-async def get_databases():
+@limiter.limit(RATE_LIMIT)
+async def get_databases(request: Request):
     """
     Get a list of all accessible Notion databases
     """
     try:
-        response = notion.search(filter={"property": "object", "value": "database"})
+        response = await cached_or_compute(
+            "databases:all",
+            lambda: app.state.notion.search(filter={"property": "object", "value": "database"})
+        )
         return response["results"]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/notion/schema")
+@limiter.limit(RATE_LIMIT)
+async def get_database_schema(request: Request):
+    """
+    Get the schema (title and property definitions) of the configured database
+    """
+    try:
+        return await app.state.notion_cache.get_schema(database_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/notion/pages")
-async def get_notion_pages():
+@limiter.limit(RATE_LIMIT)
+async def get_notion_pages(request: Request):
     """
     Get all pages from the configured database
     """
     try:
-        response = notion.databases.query(
-            database_id=database_id
+        response = await cached_or_compute(
+            "pages:all",
+            lambda: app.state.notion.databases.query(database_id=database_id)
         )
         # Format the response to be more readable
         pages = []
@@ -98,104 +248,175 @@ async def get_notion_pages():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _list_block_children(block_id: str) -> List[Dict[str, Any]]:
+    """
+    Get every child block of a block or page, 100 at a time
+    """
+    blocks = []
+    start_cursor = None
+    while True:
+        response = await app.state.notion.blocks.children.list(
+            block_id=block_id,
+            start_cursor=start_cursor,
+            page_size=100
+        )
+        blocks.extend(response["results"])
+
+        if not response["has_more"]:
+            return blocks
+        start_cursor = response["next_cursor"]
+
+async def _fetch_content(page_id: str) -> List[Dict[str, str]]:
+    """
+    Fetch a page's blocks and keep the text of the ones in TEXT_BLOCK_TYPES
+    """
+    content = []
+    for block in await _list_block_children(page_id):
+        block_type = block["type"]
+        if block_type in TEXT_BLOCK_TYPES:
+            content.append({
+                "type": block_type,
+                "content": _join_plain(block[block_type].get("rich_text"))
+            })
+    return content
+
+async def _fetch_page(page_id: str) -> Dict[str, Any]:
+    """
+    Fetch a page's metadata and its text blocks
+    """
+    # Get page metadata and content (blocks) concurrently
+    page, content = await asyncio.gather(
+        app.state.notion.pages.retrieve(page_id=page_id),
+        _fetch_content(page_id)
+    )
+
+    return {
+        "metadata": page,
+        "content": content
+    }
+
 @app.get("/notion/page/{page_id}")
-async def get_notion_page(page_id: str):
+@limiter.limit(RATE_LIMIT)
+async def get_notion_page(request: Request, page_id: str):
     """
     Get detailed content of a specific page
     """
     try:
-        # Get page metadata
-        page = notion.pages.retrieve(page_id=page_id)
-        
-        # Get page content (blocks)
-        blocks = notion.blocks.children.list(block_id=page_id)
-        
-        # Format the response
-        content = []
-        for block in blocks["results"]:
-            block_type = block["type"]
-            if block_type in ["paragraph", "heading_1", "heading_2", "heading_3", "bulleted_list_item"]:
-                text_content = ""
-                if "rich_text" in block[block_type]:
-                    for text in block[block_type]["rich_text"]:
-                        text_content += text["plain_text"]
-                content.append({
-                    "type": block_type,
-                    "content": text_content
-                })
-        
-        return {
-            "metadata": page,
-            "content": content
-        }
+        return await cached_or_compute(f"page:{page_id}", lambda: _fetch_page(page_id))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/notion/pages/full")
+@limiter.limit(RATE_LIMIT)
+async def get_notion_pages_full(request: Request, pages: PageIds):
+    """
+    Get the content of several pages at once, fetching them concurrently
+    Pages that fail are returned with an error instead of their content
+    """
+    semaphore = asyncio.Semaphore(3)
+
+    async def fetch_one(page_id: str) -> List[Dict[str, str]]:
+        async with semaphore:
+            return await cached_or_compute(f"content:{page_id}", lambda: _fetch_content(page_id))
+
+    page_ids = list(dict.fromkeys(pages.page_ids))
+    results = await asyncio.gather(*(fetch_one(page_id) for page_id in page_ids), return_exceptions=True)
+
+    return {
+        page_id: {"error": str(result)} if isinstance(result, Exception) else {"content": result}
+        for page_id, result in zip(page_ids, results)
+    }
+
 @app.post("/notion/query")
-async def query_database(query: NotionQuery):
+@limiter.limit(RATE_LIMIT)
+async def query_database(request: Request, query: NotionQuery):
     """
     Query the database with custom filters and sorts
     """
     try:
-        response = notion.databases.query(
-            database_id=database_id,
-            filter=query.filter,
-            sorts=query.sorts
+        response = await cached_or_compute(
+            "query:" + _hash_key(query.filter, query.sorts),
+            lambda: app.state.notion.databases.query(
+                database_id=database_id,
+                filter=query.filter,
+                sorts=query.sorts
+            )
         )
         return response["results"]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _format_page(page: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Flatten a Notion page into its id, url, timestamps and plain property values
+    """
+    formatted_page = {
+        "id": page["id"],
+        "url": page["url"],
+        "created_time": page["created_time"],
+        "last_edited_time": page["last_edited_time"],
+        "properties": {}
+    }
+
+    # Extract and format properties
+    properties = formatted_page["properties"]
+    get_formatter = FORMATTERS.get
+    for prop_name, prop_data in page["properties"].items():
+        prop_type = prop_data["type"]
+        value = prop_data[prop_type]
+        formatter = get_formatter(prop_type)
+        properties[prop_name] = formatter(value) if formatter else value
+
+    return formatted_page
+
+async def _paginate_db(
+    start_cursor: Optional[str] = None,
+    page_size: int = 100,
+    max_pages: int = 10
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Yield raw query responses from the configured database, following next_cursor
+    until Notion reports no more results or max_pages rounds have been made
+    """
+    for _ in range(max_pages):
+        response = await app.state.notion.databases.query(
+            database_id=database_id,
+            start_cursor=start_cursor,
+            page_size=min(page_size, 100)  # Ensure we don't exceed the 100 item limit
+        )
+        yield response
+
+        if not response["has_more"]:
+            break
+        start_cursor = response.get("next_cursor")
+
 @app.post("/notion/test-database")
-async def test_database_access(pagination: PaginationParams):
+@limiter.limit(RATE_LIMIT)
+async def test_database_access(request: Request, pagination: PaginationParams):
     """
     Test endpoint to verify database access with pagination
     Returns a paginated list of pages from the database
     """
     try:
-        # Query the database with pagination parameters
-        response = notion.databases.query(
-            database_id=database_id,
+        # Query a single page of the database with the pagination parameters
+        responses = _paginate_db(
             start_cursor=pagination.start_cursor,
-            page_size=min(pagination.page_size, 100)  # Ensure we don't exceed the 100 item limit
+            page_size=pagination.page_size,
+            max_pages=1
         )
-        
-        # Format the response
-        formatted_response = {
+        try:
+            response = await anext(responses)
+        finally:
+            await responses.aclose()
+
+        return {
             "object": "list",
-            "results": [],
+            "results": [_format_page(page) for page in response["results"]],
             "has_more": response["has_more"],
             "next_cursor": response.get("next_cursor"),
             "type": "page"
         }
 
-        # Format each page in the results
-        for page in response["results"]:
-            formatted_page = {
-                "id": page["id"],
-                "url": page["url"],
-                "created_time": page["created_time"],
-                "last_edited_time": page["last_edited_time"],
-                "properties": {}
-            }
-            
-            # Extract and format properties
-            for prop_name, prop_data in page["properties"].items():
-                if prop_data["type"] == "title":
-                    formatted_page["properties"][prop_name] = "".join(
-                        text["plain_text"] for text in prop_data["title"]
-                    )
-                elif prop_data["type"] == "rich_text":
-                    formatted_page["properties"][prop_name] = "".join(
-                        text["plain_text"] for text in prop_data["rich_text"]
-                    )
-                else:
-                    formatted_page["properties"][prop_name] = prop_data[prop_data["type"]]
-            
-            formatted_response["results"].append(formatted_page)
-
-        return formatted_response
-
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -208,40 +429,19 @@ async def test_database_access(pagination: PaginationParams):
 
 # Add this helper endpoint to test pagination
 @app.get("/notion/test-pagination")
-async def test_pagination():
+@limiter.limit(RATE_LIMIT)
+async def test_pagination(request: Request):
     """
     Test endpoint that demonstrates pagination by fetching all pages
+    Streams one formatted page per line (NDJSON) as each round arrives from Notion
     """
+    # Limit to 10 rounds of 100 items to avoid infinite loops
+    responses = _paginate_db(page_size=100, max_pages=10)
     try:
-        all_pages = []
-        has_more = True
-        next_cursor = None
-        page_count = 0
-
-        while has_more:
-            response = await test_database_access(
-                PaginationParams(
-                    start_cursor=next_cursor,
-                    page_size=10
-                )
-            )
-            
-            all_pages.extend(response["results"])
-            has_more = response["has_more"]
-            next_cursor = response.get("next_cursor")
-            page_count += 1
-
-            # Optional: break after a certain number of pages to avoid infinite loops
-            if page_count >= 10:  # Limit to 10 pages maximum
-                break
-
-        return {
-            "total_pages_fetched": len(all_pages),
-            "pagination_rounds": page_count,
-            "pages": all_pages
-        }
-
+        # Fetch the first round before streaming so access errors still return a 500
+        first = await anext(responses)
     except Exception as e:
+        await responses.aclose()
         raise HTTPException(
             status_code=500,
             detail={
@@ -250,7 +450,31 @@ async def test_pagination():
             }
         )
 
+    async def stream_pages() -> AsyncIterator[bytes]:
+        try:
+            for page in first["results"]:
+                yield orjson.dumps(_format_page(page)) + b"\n"
+            async for response in responses:
+                for page in response["results"]:
+                    yield orjson.dumps(_format_page(page)) + b"\n"
+        except Exception as e:
+            # Headers are already sent, so report the failure as a final line
+            logger.error("Pagination failed mid-stream: %s", e)
+            yield orjson.dumps({"error": str(e), "message": "Failed to test pagination"}) + b"\n"
+
+    return StreamingResponse(stream_pages(), media_type="application/x-ndjson")
+
 if __name__ == "__main__":
+    import sys
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run("main:app", host="0.0.0.0", port=port) 
\ No newline at end of file
+    # Workers read WEB_CONCURRENCY at startup, so make sure they see the default too
+    os.environ.setdefault("WEB_CONCURRENCY", "2")
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop" if sys.platform != "win32" else "asyncio",  # uvloop isn't available on Windows
+        http="httptools",
+        workers=int(os.environ["WEB_CONCURRENCY"])
+    ) 
\ No newline at end of file
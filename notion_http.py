@@ -0,0 +1,73 @@
+import asyncio
+import random
+import httpx
+from aiolimiter import AsyncLimiter
+
+# Notion allows an average of 3 requests per second per integration
+NOTION_MAX_RATE = 2.5
+RETRY_STATUS_CODES = (429, 502, 503)
+
+
+class RateLimitedTransport(httpx.AsyncBaseTransport):
+    def __init__(
+        self,
+        transport: httpx.AsyncBaseTransport,
+        max_rate: float = NOTION_MAX_RATE,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+        max_concurrency: int = 8,
+    ):
+        """
+        Pace requests to stay under Notion's rate limit and retry throttled ones
+
+        Args:
+            transport: The transport that actually sends requests
+            max_rate: Maximum number of requests started per second
+            max_retries: How many times to retry a 429/502/503 response
+            backoff: Initial delay in seconds when no Retry-After header is sent
+            max_concurrency: Maximum number of requests in flight at once
+        """
+        self.transport = transport
+        self.limiter = AsyncLimiter(max_rate=max_rate, time_period=1)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        delay = self.backoff
+        for attempt in range(self.max_retries + 1):
+            # Wait for a free slot before taking a rate limit token, so queued
+            # callers don't burn tokens they can't use yet
+            async with self.semaphore:
+                async with self.limiter:
+                    response = await self.transport.handle_async_request(request)
+
+            if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                return response
+
+            # Honour Retry-After when Notion sends it, otherwise back off exponentially
+            try:
+                wait = float(response.headers["Retry-After"])
+            except (KeyError, ValueError):
+                wait = delay
+            await response.aclose()
+            await asyncio.sleep(wait + random.uniform(0, wait / 4))
+            delay *= 2
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+def build_http_client(max_rate: float = NOTION_MAX_RATE) -> httpx.AsyncClient:
+    """
+    Build a keep-alive HTTP/2 client for the Notion API that is paced by a
+    RateLimitedTransport. Pass it to notion_client.AsyncClient(client=...).
+    """
+    transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=60),
+    )
+    return httpx.AsyncClient(
+        transport=RateLimitedTransport(transport, max_rate=max_rate),
+        timeout=httpx.Timeout(30.0),
+    )
@@ -1,17 +1,125 @@
-import qrcode
+import segno
+import msgspec
 import os
-from notion_client import Client
-from typing import List, Dict, Optional
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
+import httpx
+from notion_client import AsyncClient
+from notion_client.errors import APIResponseError, HTTPResponseError, RequestTimeoutError, is_api_error_code
+from notion_http import build_http_client
+from typing import List, Dict, Optional, Tuple
 from datetime import datetime
 from pathlib import Path
 from dotenv import load_dotenv
 from pprint import pprint
 from urllib.parse import quote_plus
 import json
+from collections import defaultdict
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Database schemas rarely change, so reuse a fetched schema for 5 minutes
+SCHEMA_TTL = 300
+
+class _SafeFilenameTable(dict):
+    """
+    str.translate table that keeps letters, digits, spaces, '-' and '_' and drops
+    everything else. Entries are filled in on first use instead of for all of Unicode.
+    """
+    def __missing__(self, codepoint: int) -> Optional[int]:
+        char = chr(codepoint)
+        self[codepoint] = codepoint if char.isalnum() or char in " -_" else None
+        return self[codepoint]
+
+_SAFE_TABLE = _SafeFilenameTable()
+
+# Notion page URLs are 54 characters, which a version 6 QR code holds at
+# error level H (up to 58 bytes), so the version search can be skipped
+_QR_VERSION = 6
+_QR_VERSION_CAPACITY = 58
+
+def _render_qr(url: str, out_path: str) -> None:
+    """
+    Render a QR code for a URL and save it as a 1-bit PNG
+
+    Kept at module level so it can be pickled into a ProcessPoolExecutor worker.
+    """
+    version = _QR_VERSION if len(url) <= _QR_VERSION_CAPACITY else None
+    qr = segno.make_qr(url, error="h", version=version, boost_error=False)
+    qr.save(out_path, scale=10, border=4)
+
+# Typed views of the parts of a database query response that QR generation reads.
+# msgspec decodes the raw response bytes straight into these and skips every other field.
+class Text(msgspec.Struct):
+    content: str = ""
+
+class RichText(msgspec.Struct):
+    text: Optional[Text] = None  # Mentions and equations have no "text"
+
+class TitleProperty(msgspec.Struct):
+    title: List[RichText] = []
+
+class RichTextProperty(msgspec.Struct):
+    rich_text: List[RichText] = []
+
+class InventoryProperties(msgspec.Struct):
+    Item: Optional[TitleProperty] = None
+    Quantity: Optional[RichTextProperty] = None
+
+class InventoryPage(msgspec.Struct):
+    id: str
+    properties: InventoryProperties
+
+class NotionQueryResponse(msgspec.Struct):
+    results: List[InventoryPage]
+    has_more: bool = False
+    next_cursor: Optional[str] = None
+
+_QUERY_DECODER = msgspec.json.Decoder(NotionQueryResponse)
+
+def _notion_error(response: httpx.Response) -> HTTPResponseError:
+    """
+    Build the error notion_client would raise for a failed response
+    """
+    try:
+        body = response.json()
+    except ValueError:
+        body = {}
+    code = body.get("code") if isinstance(body, dict) else None
+    if code and is_api_error_code(code):
+        return APIResponseError(response, body["message"], code)
+    return HTTPResponseError(response)
+
+def _item_name(properties: InventoryProperties) -> Optional[str]:
+    """
+    Text of an item's Item title, or None if it has no plain text title
+    """
+    if properties.Item is None or not properties.Item.title or properties.Item.title[0].text is None:
+        return None
+    return properties.Item.title[0].text.content
+
+def _quantity(properties: InventoryProperties) -> int:
+    """
+    Quantity of an item: 0 when the Quantity field is empty, 1 when it isn't a number
+    """
+    quantity = properties.Quantity
+    if quantity is None or not quantity.rich_text or quantity.rich_text[0].text is None:
+        return 0
+    content = quantity.rich_text[0].text.content
+    if not content:
+        return 0
+    stripped = content.strip()
+    digits = stripped[1:] if stripped[:1] in ('+', '-') else stripped
+    if digits.isdecimal():
+        return int(stripped)
+    # Rare forms such as "1_000" are still accepted by int(), so let it decide
+    try:
+        return int(content)
+    except ValueError:
+        return 1
+
 class NotionQRGenerator:
     def __init__(self, notion_token: str, database_id: str, workspace: str):
         """
@@ -25,15 +133,23 @@ class NotionQRGenerator:
         if not notion_token or not database_id or not workspace:
             raise ValueError("Missing required environment variables: NOTION_TOKEN, NOTION_DATABASE_ID, and NOTION_WORKSPACE")
             
-        self.notion = Client(auth=notion_token)
+        self.notion = AsyncClient(auth=notion_token, client=build_http_client())
         self.database_id = database_id
         self.workspace = workspace
         self.output_dir = Path(__file__).parent / "qr_codes"
         self.schema = None  # Will store database schema
+        self.schema_fetched_at = None  # time.monotonic() when schema was fetched
+        
+    async def aclose(self) -> None:
+        """Close the Notion connection pool"""
+        await self.notion.aclose()
+
+    async def get_database_schema(self) -> Dict:
+        """Get database schema to understand its structure, reusing it for SCHEMA_TTL seconds"""
+        if self.schema is not None and time.monotonic() - self.schema_fetched_at < SCHEMA_TTL:
+            return self.schema
         
-    def get_database_schema(self) -> Dict:
-        """Get database schema to understand its structure"""
-        response = self.notion.databases.retrieve(database_id=self.database_id)
+        response = await self.notion.databases.retrieve(database_id=self.database_id)
         
         # Extract property configurations
         properties = response["properties"]
@@ -44,50 +160,48 @@ class NotionQRGenerator:
             }
         }
         
+        self.schema_fetched_at = time.monotonic()
+        
         print("\nDatabase Schema:")
         pprint(self.schema)
         return self.schema
         
-    def generate_item_qr(self, page_id: str, properties: Dict) -> None:
+    def _item_qr_target(self, page_id: str, item_name: str) -> Tuple[str, Path]:
         """
-        Generate QR code for a single inventory item with title
-        
+        Work out the Notion URL and output path of an item's QR code
+
         Args:
             page_id: Notion page ID for the item
-            properties: Item properties from Notion
+            item_name: Title of the item
         """
-        # Get item name from Item field
-        if 'Item' not in properties or not properties['Item']['title']:
-            raise ValueError(f"Could not find Item title in properties: {properties}")
-            
-        item_name = properties['Item']['title'][0]['text']['content']
-        
         # Create Notion page URL
         notion_url = f"https://www.notion.so/{page_id.replace('-', '')}"
         print(f"Generated URL for item {item_name}: {notion_url}")
         
-        # Generate QR code
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_H,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(notion_url)
-        qr.make(fit=True)
-        
-        # Create QR code with title
-        qr_image = qr.make_image(fill_color="black", back_color="white")
-        
         # Create safe filename from item name
-        safe_filename = "".join(c for c in item_name if c.isalnum() or c in (' ','-','_')).rstrip()
+        safe_filename = item_name.translate(_SAFE_TABLE).rstrip()
         
         # Add timestamp to filename
         timestamp = datetime.now().strftime("%Y%m%d")
         filename = f"{safe_filename}_{timestamp}.png"
         
-        # Save QR code
-        qr_image.save(self.output_dir / filename)
+        return notion_url, self.output_dir / filename
+
+    def generate_item_qr(self, page_id: str, properties: Dict) -> None:
+        """
+        Generate QR code for a single inventory item with title
+        
+        Args:
+            page_id: Notion page ID for the item
+            properties: Item properties from Notion
+        """
+        # Get item name from Item field
+        if 'Item' not in properties or not properties['Item']['title']:
+            raise ValueError(f"Could not find Item title in properties: {properties}")
+            
+        item_name = properties['Item']['title'][0]['text']['content']
+        notion_url, path = self._item_qr_target(page_id, item_name)
+        _render_qr(notion_url, str(path))
         print(f"Generated QR code for: {item_name}")
         
     def generate_location_qr(self, location: Dict) -> None:
@@ -104,89 +218,151 @@ class NotionQRGenerator:
             
             # Generate QR code...
             
-    def generate_all_qrs(self) -> None:
-        """Generate QR codes for semi-consumable items only, collapsing duplicates"""
+    @property
+    def manifest_path(self) -> Path:
+        return self.output_dir / ".manifest.json"
+
+    def _load_manifest(self) -> Dict:
+        """Load the page_id -> rendered QR code manifest, or start a new one"""
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_manifest(self, manifest: Dict) -> None:
+        """Write the manifest atomically so an interrupted run can't corrupt it"""
+        tmp_path = self.manifest_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _is_up_to_date(self, manifest: Dict, page_id: str, item_name: str, notion_url: str) -> bool:
+        """Check whether a QR code for this page, name and URL was already rendered"""
+        entry = manifest.get(page_id)
+        if not entry or entry.get("url") != notion_url or entry.get("name") != item_name:
+            return False
+        return (self.output_dir / entry["file"]).is_file()
+
+    async def _query_items(self, start_cursor: Optional[str] = None) -> NotionQueryResponse:
+        """
+        Query one page of semi-consumable items
+
+        The raw response body is decoded with msgspec instead of going through
+        the SDK's response.json(), so only the fields we read are materialised.
+        """
+        body = {
+            "filter": {
+                "property": "Category",
+                "multi_select": {
+                    "contains": "Semi-consumable"
+                }
+            },
+            "page_size": 100
+        }
+        
+        if start_cursor:
+            body["start_cursor"] = start_cursor
+        
+        # This bypasses AsyncClient.request(), so log and map errors the same way it does
+        path = f"databases/{self.database_id}/query"
+        self.notion.logger.info(f"POST {self.notion.client.base_url}{path}")
+        try:
+            response = await self.notion.client.post(path, json=body)
+        except httpx.TimeoutException:
+            raise RequestTimeoutError()
+        if response.is_error:
+            raise _notion_error(response)
+        return _QUERY_DECODER.decode(response.content)
+
+    async def generate_all_qrs(self) -> None:
+        """
+        Generate QR codes for semi-consumable items only, collapsing duplicates
+
+        QR codes are rendered in a process pool as soon as a new item name is seen,
+        so PNG encoding overlaps with fetching the next page of results from Notion.
+        Items whose QR code is already recorded in the manifest are skipped.
+        """
         self.output_dir.mkdir(exist_ok=True)
         print("Getting database schema...")
-        self.get_database_schema()
+        await self.get_database_schema()
         
         print("\nQuerying database for semi-consumable items...")
         
+        loop = asyncio.get_running_loop()
         all_results = []
+        items_by_name = defaultdict(lambda: {'items': [], 'total_quantity': 0})
+        targets = {}
+        renders = {}
+        up_to_date = []
+        manifest = await asyncio.to_thread(self._load_manifest)
         start_cursor = None
         
-        # Get all semi-consumable items
-        while True:
-            query_params = {
-                "database_id": self.database_id,
-                "filter": {
-                    "property": "Category",
-                    "multi_select": {
-                        "contains": "Semi-consumable"
-                    }
-                },
-                "page_size": 100
-            }
-            
-            if start_cursor:
-                query_params["start_cursor"] = start_cursor
-            
-            response = self.notion.databases.query(**query_params)
-            all_results.extend(response["results"])
-            
-            if not response.get("has_more"):
-                break
-            start_cursor = response.get("next_cursor")
-        
-        print(f"\nFound total of {len(all_results)} semi-consumable items")
-        
-        # Group items by name
-        items_by_name = {}
-        for item in all_results:
-            try:
-                item_name = item['properties']['Item']['title'][0]['text']['content']
-                if item_name not in items_by_name:
-                    items_by_name[item_name] = {
-                        'items': [],
-                        'total_quantity': 0
-                    }
-                items_by_name[item_name]['items'].append(item)
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            # Get all semi-consumable items
+            while True:
+                response = await self._query_items(start_cursor)
+                all_results.extend(response.results)
                 
-                # Try to get quantity if it exists
-                try:
-                    quantity_text = item['properties'].get('Quantity', {}).get('rich_text', [])
-                    if quantity_text and quantity_text[0].get('text', {}).get('content'):
-                        qty = int(quantity_text[0]['text']['content'])
-                        items_by_name[item_name]['total_quantity'] += qty
-                except (ValueError, KeyError, IndexError):
-                    items_by_name[item_name]['total_quantity'] += 1
+                # Group items by name
+                for item in response.results:
+                    item_name = _item_name(item.properties)
+                    if item_name is None:
+                        print(f"Error processing item: could not find Item title for {item.id}")
+                        continue
                     
-            except Exception as e:
-                print(f"Error processing item: {str(e)}")
-                continue
+                    if item_name not in targets:
+                        # Use the first item's ID for the QR code
+                        notion_url, path = self._item_qr_target(item.id, item_name)
+                        targets[item_name] = (item.id, notion_url, path)
+                        if self._is_up_to_date(manifest, item.id, item_name, notion_url):
+                            up_to_date.append(item_name)
+                        else:
+                            renders[item_name] = loop.run_in_executor(
+                                executor, _render_qr, notion_url, str(path)
+                            )
+                    group = items_by_name[item_name]
+                    group['items'].append(item)
+                    group['total_quantity'] += _quantity(item.properties)
+                
+                if not response.has_more:
+                    break
+                start_cursor = response.next_cursor
+            
+            print(f"\nFound total of {len(all_results)} semi-consumable items")
+            
+            results = await asyncio.gather(*renders.values(), return_exceptions=True)
         
-        # Generate QR codes for unique items
+        # Report QR codes generated for unique items
         generated_count = 0
-        for item_name, data in items_by_name.items():
-            try:
-                # Use the first item's ID for the QR code
-                first_item = data['items'][0]
-                print(f"\nProcessing: {item_name}")
-                print(f"Found {len(data['items'])} instances")
-                if data['total_quantity'] > 1:
-                    print(f"Total quantity: {data['total_quantity']}")
-                
-                self.generate_item_qr(first_item["id"], first_item["properties"])
-                generated_count += 1
-                
-            except Exception as e:
-                print(f"Error generating QR for {item_name}: {str(e)}")
+        for item_name, result in zip(renders, results):
+            data = items_by_name[item_name]
+            if isinstance(result, Exception):
+                print(f"Error generating QR for {item_name}: {str(result)}")
                 continue
+            
+            print(f"\nProcessing: {item_name}")
+            print(f"Found {len(data['items'])} instances")
+            if data['total_quantity'] > 1:
+                print(f"Total quantity: {data['total_quantity']}")
+            print(f"Generated QR code for: {item_name}")
+            generated_count += 1
+            
+            page_id, notion_url, path = targets[item_name]
+            manifest[page_id] = {
+                "name": item_name,
+                "url": notion_url,
+                "file": path.name,
+                "mtime": path.stat().st_mtime
+            }
+        
+        await asyncio.to_thread(self._save_manifest, manifest)
         
         print(f"\nSummary:")
         print(f"Total items found: {len(all_results)}")
         print(f"Unique items: {len(items_by_name)}")
         print(f"QR codes generated: {generated_count}")
+        print(f"QR codes already up to date: {len(up_to_date)}")
         
         # Print details of collapsed items
         print("\nCollapsed items:")
@@ -203,9 +379,15 @@ if __name__ == "__main__":
         print("Error: Missing required environment variables. Please check your .env file.")
         exit(1)
         
-    try:
+    async def main() -> None:
         generator = NotionQRGenerator(NOTION_TOKEN, DATABASE_ID, WORKSPACE)
-        generator.generate_all_qrs()
+        try:
+            await generator.generate_all_qrs()
+        finally:
+            await generator.aclose()
+        
+    try:
+        asyncio.run(main())
     except Exception as e:
         print(f"Error: {str(e)}")
         exit(1)
\ No newline at end of file